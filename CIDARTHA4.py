@@ -13,6 +13,9 @@ from config import CIDARTHAConfig, get_default_config
 # Predefine bit masks
 MASKS = [(0xFF << (8 - i)) & 0xFF for i in range(1, 9)]
 
+# dump() format version; load() rejects dumps written by a newer format
+_FORMAT_VERSION = 1
+
 # Custom logger setup
 logger = logging.getLogger("CIDARTHA")
 logger.setLevel(logging.INFO)
@@ -35,6 +38,8 @@ def _ip_to_bytes_cached_impl(ip: str) -> bytes:
 
 
 # Default global cache with standard size
+# Conversions do not depend on any trie's contents, so trie modifications
+# leave this cache alone (only per-instance check caches are cleared)
 _ip_to_bytes_cached = lru_cache(maxsize=8192)(_ip_to_bytes_cached_impl)
 
 
@@ -61,16 +66,31 @@ def configure_global_ip_cache(cache_size: int = 8192):
     _ip_to_bytes_cached = lru_cache(maxsize=cache_size)(_ip_to_bytes_cached_impl)
 
 
+def _prefix_range(addr: bytes, prefix_len: int) -> Tuple[bytes, bytes]:
+    """Return the (first, last) packed addresses of addr/prefix_len."""
+    size = len(addr)
+    bits = size << 3
+    if bits not in (32, 128):
+        raise ValueError(f"Packed address must be 4 or 16 bytes, got {size}")
+    if not 0 <= prefix_len <= bits:
+        raise ValueError(f"Prefix length {prefix_len} out of range for /{bits}")
+
+    host_mask = (1 << (bits - prefix_len)) - 1
+    start = int.from_bytes(addr, "big") & ~host_mask
+    return start.to_bytes(size, "big"), (start | host_mask).to_bytes(size, "big")
+
+
 def _ip_to_bytes(ip) -> bytes:
     """CPython-optimized IP → bytes conversion."""
     t = type(ip)
 
-    if t is bytes:
-        return ip
-
+    # Most common input first
     if t is str:
         return _ip_to_bytes_cached(ip)
 
+    if t is bytes:
+        return ip
+
     if t is int:
         return b"\x00" if ip == 0 else ip.to_bytes((ip.bit_length() + 7) >> 3, "big")
 
@@ -120,22 +140,42 @@ class CIDARTHANode:
             children = {k: v.to_compact_tuple() for k, v in self._children.items()}
         return (self.is_end, self.range_start, self.range_end, children)
 
-    @staticmethod
-    def from_compact_tuple(data: Tuple) -> "CIDARTHANode":
-        """Deserialize from compact tuple format."""
-        is_end, start, end, children_dict = data
-        node = CIDARTHANode(is_end=is_end, range_start=start, range_end=end)
-
-        if children_dict:
-            # Direct assignment to avoid __setitem__ overhead during construction
-            node._children = {
-                k: CIDARTHANode.from_compact_tuple(v) for k, v in children_dict.items()
-            }
 
-        return node
+def _read_format_version(serialized_data) -> int:
+    """Read the dump() format version from the head of serialized data."""
+    # dump() writes 'version' as the first map key, so a fixmap byte, the
+    # 8-byte key and an int of at most 9 bytes all fit in the first 18 bytes.
+    # Only that slice is fed, so the full buffer is neither copied nor decoded.
+    head = msgpack.Unpacker(raw=False)
+    head.feed(serialized_data[:18])
+    try:
+        head.read_map_header()
+        if head.unpack() != 'version':
+            return 1  # Dumps from before versioning start with 'root'
+        version = head.unpack()
+    except (msgpack.OutOfData, msgpack.UnpackException, ValueError) as e:
+        raise ValueError(f"Malformed serialization header: {e}") from e
+    if type(version) is not int:
+        raise ValueError(f"Malformed serialization format version: {version!r}")
+    return version
+
+
+def _node_from_fields(fields) -> CIDARTHANode:
+    """Build a node from a decoded (is_end, start, end, children) array."""
+    if len(fields) != 4:
+        raise ValueError(f"Malformed trie node: expected 4 fields, got {len(fields)}")
+    children = fields[3]
+    if children is not None and type(children) is not dict:
+        raise ValueError(f"Malformed trie node children: {type(children).__name__}")
+    return CIDARTHANode(*fields)
 
 
 class CIDARTHA:
+    __slots__ = (
+        'root', '_lock', 'config', '_cached_ip_network', 'check', '_tune_snapshot',
+        '__weakref__',
+    )
+
     def __init__(self, config=None):
         """
         Initialize CIDARTHA with optional configuration.
@@ -156,32 +196,30 @@ class CIDARTHA:
         self.root = CIDARTHANode()
         self._lock = RLock()  # Reentrant lock for thread safety
         
-        # Always set config, but only do extra work if it's custom
         if config is None:
             # Use global default config (respects set_default_config changes)
             self.config = get_default_config()
         else:
-            # Custom config path: set logger and create custom caches
             self.config = config
             logger.setLevel(config.log_level)
-            # Create custom cache wrappers with configured sizes
-            self._cached_ip_network = lru_cache(maxsize=config.ip_network_cache_size)(
-                self._cached_ip_network_impl
-            )
-            self.check = lru_cache(maxsize=config.check_cache_size)(
-                self._check_impl
-            )
-    
-    # Default cached methods with standard sizes (used when config is None)
-    @lru_cache(maxsize=4096)
-    def _cached_ip_network(self, input_data: str):
-        """Cache ip_network calls."""
-        return ip_network(input_data, strict=False)
+        
+        self._init_caches()
     
-    @lru_cache(maxsize=4096)
-    def check(self, ip) -> bool:
-        """Optimized IP lookup with direct dict access."""
-        return self._check_impl(ip)
+    def _init_caches(self):
+        """
+        Build this instance's LRU caches, sized from self.config.
+        
+        The caches wrap bound methods, so each instance owns its cache and the
+        C-level lru_cache keys on the argument alone rather than (self, arg).
+        """
+        config = self.config
+        self._cached_ip_network = lru_cache(maxsize=config.ip_network_cache_size)(
+            self._cached_ip_network_impl
+        )
+        self.check = lru_cache(maxsize=config.check_cache_size)(
+            self._check_impl
+        )
+        self._tune_snapshot = (0, 0)  # (hits, misses) at last tune_check_cache()
     
     def _cached_ip_network_impl(self, input_data: str):
         """Cache ip_network calls (implementation)."""
@@ -209,34 +247,80 @@ class CIDARTHA:
         
         return False
 
+    def check_many(self, ips) -> list:
+        """
+        Look up many IPs in one call.
+        
+        Accepts any iterable of the inputs check() understands (str, bytes,
+        int, IPv4Address/IPv6Address) and returns a list of bools in the same
+        order. Results go through the same cache as check().
+        """
+        return list(map(self.check, ips))
+
+    def _clear_check_cache(self):
+        """Drop cached lookups after a trie modification (lock must be held)."""
+        self.check.cache_clear()
+        # cache_clear() also zeroes the hit/miss counters tune_check_cache reads
+        self._tune_snapshot = (0, 0)
+
+    def tune_check_cache(self, min_size: int = 256, max_size: int = 65536,
+                         low_hit_rate: float = 0.7, high_hit_rate: float = 0.98) -> Optional[int]:
+        """
+        Resize the check() cache based on its hit rate since the last call.
+        
+        Meant to be called periodically (e.g. from a maintenance task). The
+        cache doubles, up to max_size, when the hit rate was below
+        low_hit_rate and the cache is full; it halves, down to min_size, when
+        the hit rate was above high_hit_rate and less than half of it is in
+        use. Resizing drops the cached results. An unbounded cache
+        (check_cache_size=None) is left as is.
+        
+        Returns:
+            Optional[int]: The check() cache size after tuning, or None if
+            the cache is unbounded.
+        """
+        with self._lock:
+            info = self.check.cache_info()
+            if info.maxsize is None:
+                return None
+            last_hits, last_misses = self._tune_snapshot
+            if info.hits < last_hits or info.misses < last_misses:
+                # check.cache_clear() was called directly, zeroing the counters
+                # without going through _clear_check_cache()
+                last_hits = last_misses = 0
+            hits = info.hits - last_hits
+            total = hits + info.misses - last_misses
+            size = new_size = info.maxsize
+            if total:
+                hit_rate = hits / total
+                if hit_rate < low_hit_rate and info.currsize >= size:
+                    new_size = min(size * 2, max_size)
+                elif hit_rate > high_hit_rate and info.currsize < size // 2:
+                    new_size = max(size // 2, min_size)
+            
+            if new_size != size:
+                self.check = lru_cache(maxsize=new_size)(self._check_impl)
+                self._tune_snapshot = (0, 0)
+                logger.debug("Resized check cache from %d to %d (hit rate %.2f)", size, new_size, hit_rate)
+            else:
+                self._tune_snapshot = (info.hits, info.misses)
+            return new_size
+
     def __getstate__(self):
-        state = self.__dict__.copy()
-        del state['_lock']
-        # Only remove cached methods if they were customized (config is not None)
-        if self.config is not None:
-            if 'check' in state:
-                del state['check']
-            if '_cached_ip_network' in state:
-                del state['_cached_ip_network']
-        return state
+        # The lock and cached wrappers are rebuilt from config on unpickle
+        return {'root': self.root, 'config': self.config}
 
     def __setstate__(self, state):
-        self.__dict__.update(state)
+        self.root = state['root']
+        self.config = state['config']
         self._lock = RLock()
-        # Recreate customized cached methods if config was used
-        if self.config is not None:
-            self._cached_ip_network = lru_cache(maxsize=self.config.ip_network_cache_size)(
-                self._cached_ip_network_impl
-            )
-            self.check = lru_cache(maxsize=self.config.check_cache_size)(
-                self._check_impl
-            )
+        self._init_caches()
 
     def dump(self) -> bytes:
         """Dump trie to compact msgpack bytes."""
         logger.info("Starting serialization.")
         root_tuple = self.root.to_compact_tuple()
-        flat_data = {'root': root_tuple}
+        flat_data = {'version': _FORMAT_VERSION, 'root': root_tuple}
         logger.info("Serialization complete.")
         return msgpack.packb(flat_data, use_bin_type=True)
 
@@ -246,13 +330,36 @@ class CIDARTHA:
         Load trie from msgpack bytes.
         
         Args:
-            serialized_data: Serialized trie data
+            serialized_data: Serialized trie data, as bytes or any other
+                             buffer (bytearray, memoryview, mmap); buffers are
+                             decoded in place without copying
             config: Optional CIDARTHAConfig instance for the loaded instance
+        
+        Raises:
+            ValueError: If the data is malformed or from a newer format version
         """
         logger.info("Starting deserialization.")
-        flat_data = msgpack.unpackb(serialized_data, raw=False, strict_map_key=False)
+        # Check the version before decoding: node arrays from a newer format
+        # may not fit _node_from_fields
+        version = _read_format_version(serialized_data)
+        if version > _FORMAT_VERSION:
+            raise ValueError(f"Unsupported serialization format version: {version}")
+        # Node tuples are the only arrays in the format, so build nodes as
+        # msgpack decodes them instead of walking the decoded tree again
+        flat_data = msgpack.unpackb(
+            serialized_data, raw=False, strict_map_key=False,
+            list_hook=_node_from_fields,
+        )
+        # The header only sees a leading 'version' key, so check the decoded
+        # map agrees with it wherever the key was written
+        decoded_version = flat_data.get('version', 1)
+        if type(decoded_version) is not int or decoded_version != version:
+            raise ValueError(f"Unsupported serialization format version: {decoded_version!r}")
+        root = flat_data.get('root')
+        if type(root) is not CIDARTHANode:
+            raise ValueError("Malformed serialization: missing or invalid root node")
         cidartha = CIDARTHA(config=config)
-        cidartha.root = CIDARTHANode.from_compact_tuple(flat_data['root'])
+        cidartha.root = root
         logger.info("Deserialization complete.")
         return cidartha
 
@@ -264,10 +371,9 @@ class CIDARTHA:
                 self._insert_cidr(network)
                 # Clear cache after modification (can be disabled for batch operations)
                 if _clear_cache:
-                    self.check.cache_clear()
-                    _ip_to_bytes_cached.cache_clear()
+                    self._clear_check_cache()
             except ValueError as e:
-                logger.error(f"Invalid IP or CIDR range: {input_data} - {e}")
+                logger.error("Invalid IP or CIDR range: %s - %s", input_data, e)
                 raise
 
     def batch_insert(self, entries):
@@ -284,7 +390,7 @@ class CIDARTHA:
             log_every = max(1, total // 20)  # Default: 5%
         next_log = log_every
 
-        logger.info(f"Starting batch insert of {total} entries.")
+        logger.info("Starting batch insert of %d entries.", total)
         
         # Process entries in batch with lock held for better performance
         with self._lock:
@@ -294,26 +400,60 @@ class CIDARTHA:
                         network = self._cached_ip_network(entry)
                         self._insert_cidr(network)
                         if i == next_log or i == total:
-                            logger.info(f"Inserted {i}/{total} ({100 * i / total:.1f}%)")
+                            logger.info("Inserted %d/%d (%.1f%%)", i, total, 100 * i / total)
                             next_log += log_every
                     except ValueError as e:
-                        logger.error(f"Failed to insert {entry}: {e}")
+                        logger.error("Failed to insert %s: %s", entry, e)
             
-            # Clear caches once after all inserts
-            self.check.cache_clear()
-            _ip_to_bytes_cached.cache_clear()
+            # Clear the lookup cache once after all inserts
+            self._clear_check_cache()
         
         logger.info("Batch insert complete.")
 
+    def batch_insert_raw(self, entries):
+        """
+        Batch insert pre-parsed (packed_address, prefix_len) pairs.
+        
+        Skips ip_network() parsing entirely, for callers that already hold
+        addresses as 4- or 16-byte packed values. Host bits below the prefix
+        are ignored, as with batch_insert(). Invalid entries are logged and
+        skipped.
+        """
+        logger.info("Starting raw batch insert.")
+        count = 0
+        with self._lock:
+            try:
+                for entry in entries:
+                    try:
+                        addr, prefix_len = entry
+                        start, end = _prefix_range(addr, prefix_len)
+                    except (TypeError, ValueError) as e:
+                        logger.error("Failed to insert %r: %s", entry, e)
+                        continue
+                    self._insert_range(start, prefix_len, end)
+                    count += 1
+            finally:
+                # Clear the lookup cache once after all inserts, even if
+                # iterating entries raised partway through
+                self._clear_check_cache()
+        
+        logger.info("Raw batch insert complete (%d entries).", count)
+
     def _insert_cidr(self, network):
         """Internal CIDR insertion (lock must be held)."""
+        self._insert_range(
+            network.network_address.packed,
+            network.prefixlen,
+            network.broadcast_address.packed,
+        )
+
+    def _insert_range(self, addr, prefix_len, end):
+        """Insert the prefix addr/prefix_len spanning addr..end (lock must be held)."""
         # /0 = wildcard (match everything)
-        if network.prefixlen == 0:
-            self._set_root_as_wildcard(network)
+        if prefix_len == 0:
+            self._set_root_as_wildcard(addr, end)
             return
 
-        addr = network.network_address.packed
-        prefix_len = network.prefixlen
         node = self.root
 
         full_bytes = prefix_len >> 3
@@ -361,10 +501,10 @@ class CIDARTHA:
                     children[b] = nxt
                 
                 # Mark this node as end
-                mark_end(nxt, network)
+                mark_end(nxt, addr, end)
         else:
             # Full byte prefix - mark this node as end
-            mark_end(node, network)
+            mark_end(node, addr, end)
 
     def remove(self, cidr: str):
         """Thread-safe CIDR removal."""
@@ -372,14 +512,13 @@ class CIDARTHA:
             try:
                 network = self._cached_ip_network(cidr)
             except ValueError as e:
-                logger.error(f"Invalid CIDR range: {cidr} - {e}")
+                logger.error("Invalid CIDR range: %s - %s", cidr, e)
                 raise
 
             if network.prefixlen == 0:
                 self.root = CIDARTHANode()  # Clear directly to avoid deadlock
-                # Clear caches after modification
-                self.check.cache_clear()
-                _ip_to_bytes_cached.cache_clear()
+                # Clear the lookup cache after modification
+                self._clear_check_cache()
                 return
 
             path = self._traverse_path(network.network_address.packed, network.prefixlen)
@@ -397,17 +536,15 @@ class CIDARTHA:
 
             self._remove_end_node(node)
             self._prune_empty_nodes(path)
-            # Clear caches after modification
-            self.check.cache_clear()
-            _ip_to_bytes_cached.cache_clear()
+            # Clear the lookup cache after modification
+            self._clear_check_cache()
 
     def clear(self):
         """Thread-safe clear."""
         with self._lock:
             self.root = CIDARTHANode()
-            # Clear caches after modification
-            self.check.cache_clear()
-            _ip_to_bytes_cached.cache_clear()
+            # Clear the lookup cache after modification
+            self._clear_check_cache()
 
     def _traverse_path(self, address_bytes, prefix_len=None):
         """Return list of (parent_node, byte_to_child) for traversal path."""
@@ -439,20 +576,20 @@ class CIDARTHA:
 
         return path
 
-    def _set_root_as_wildcard(self, network):
+    def _set_root_as_wildcard(self, start, end):
         self.root.is_end = True
-        self.root.range_start = network.network_address.packed
-        self.root.range_end = network.broadcast_address.packed
+        self.root.range_start = start
+        self.root.range_end = end
 
 
    ###
     # Helper methods for node manipulation
     ###
     @staticmethod
-    def _mark_as_end_node(node, network):
+    def _mark_as_end_node(node, start, end):
         node.is_end = True
-        node.range_start = network.network_address.packed
-        node.range_end = network.broadcast_address.packed
+        node.range_start = start
+        node.range_end = end
 
     @staticmethod
     def _remove_end_node(node):
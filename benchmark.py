@@ -3,13 +3,22 @@
 Benchmark script for CIDARTHA using real-world data from Firehol blocklist-ipsets.
 """
 
+import argparse
+import json
+import re
 import time
 import sys
 import os
+import socket
 import urllib.request
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 import ipaddress
+from functools import lru_cache
+from itertools import islice
 import psutil
 from CIDARTHA4 import CIDARTHA
+from timing import clean_timing
 
 # Firehol repository configuration
 FIREHOL_REPO_BRANCH = "master"
@@ -25,33 +34,74 @@ FIREHOL_URLS = [
     f"{FIREHOL_BASE_URL}/firehol_abusers_30d.netset",
 ]
 
+# One netset entry per line: surrounding whitespace trimmed, blank lines and
+# '#' comments skipped. Applied to the raw response bytes in a single pass.
+_NETSET_ENTRY = re.compile(rb'^[ \t\r]*([^#\s][^\r\n]*?)[ \t\r]*$', re.MULTILINE)
+
+# Lookups timed per sample when deriving latency percentiles. Timing whole
+# chunks keeps timer overhead out of the per-lookup figures.
+LATENCY_CHUNK = 1000
+
+
+@lru_cache(maxsize=None)
+def parse_cidr(cidr):
+    """
+    Parse a CIDR string into (packed network address, prefix length).
+
+    IPv4 entries (all of Firehol's netsets) go through socket.inet_pton and
+    bit math; anything else falls back to ipaddress. Results are memoized so
+    each entry is parsed once however many times it is consulted.
+
+    Raises:
+        ValueError: If the entry is not a valid CIDR block
+    """
+    ip, sep, prefix = cidr.partition('/')
+    packed = None
+    # Only a plain decimal prefix (or none) takes the fast path, so that
+    # "-0", "+24", "2_4", a bare "/" etc. are rejected just as ip_network
+    # rejects them; netmask forms and non-IPv4 go to ipaddress
+    if not sep or (prefix.isascii() and prefix.isdigit()):
+        try:
+            packed = socket.inet_pton(socket.AF_INET, ip)
+        except OSError:
+            pass
+    if packed is None:
+        network = ipaddress.ip_network(cidr, strict=False)
+        return network.network_address.packed, network.prefixlen
+
+    prefix_len = int(prefix) if sep else 32
+    if not 0 <= prefix_len <= 32:
+        raise ValueError(f"Invalid prefix length: {cidr}")
+    host_mask = 0xFFFFFFFF >> prefix_len
+    network = int.from_bytes(packed, 'big') & ~host_mask
+    return network.to_bytes(4, 'big'), prefix_len
+
 
 def download_netset(url):
     """Download a .netset file and return list of CIDR blocks."""
-    print(f"Downloading {url.split('/')[-1]}...", end=" ", flush=True)
+    name = url.split('/')[-1]
     
     try:
         with urllib.request.urlopen(url, timeout=30) as response:
-            content = response.read().decode('utf-8')
+            content = response.read()
         
-        # Parse CIDR blocks (skip comments and empty lines)
+        # Parse CIDR blocks; only matched entries are decoded
         cidrs = []
-        for line in content.split('\n'):
-            line = line.strip()
-            # Skip comments and empty lines
-            if line and not line.startswith('#'):
-                try:
-                    # Validate it's a valid CIDR
-                    ipaddress.ip_network(line, strict=False)
-                    cidrs.append(line)
-                except ValueError:
-                    pass  # Skip invalid entries
+        for match in _NETSET_ENTRY.finditer(content):
+            entry = match.group(1).decode('ascii', 'replace')
+            try:
+                # Validate it's a valid CIDR (parsed once, memoized)
+                parse_cidr(entry)
+                cidrs.append(entry)
+            except ValueError:
+                pass  # Skip invalid entries
         
-        print(f"✓ ({len(cidrs)} entries)")
+        # One print per file so concurrent downloads don't interleave
+        print(f"Downloading {name}... ✓ ({len(cidrs)} entries)")
         return cidrs
     
     except Exception as e:
-        print(f"✗ Error: {e}")
+        print(f"Downloading {name}... ✗ Error: {e}")
         return []
 
 
@@ -84,27 +134,33 @@ def format_rate(count, seconds):
 
 def benchmark_insert(fw, cidrs):
     """Benchmark insertion operations."""
-    print("\n📊 Benchmarking Insertion")
-    print("=" * 60)
+    out = []
+    p = out.append
+    
+    p("\n📊 Benchmarking Insertion")
+    p("=" * 60)
     
     mem_before = get_memory_usage()
-    start_time = time.time()
     
     # Use batch_insert for efficiency
-    fw.batch_insert(cidrs)
+    with clean_timing():
+        start_ns = time.perf_counter_ns()
+        fw.batch_insert(cidrs)
+        end_ns = time.perf_counter_ns()
     
-    end_time = time.time()
     mem_after = get_memory_usage()
     
-    elapsed = end_time - start_time
+    elapsed = (end_ns - start_ns) / 1e9
     mem_used = mem_after - mem_before
     
-    print(f"Total entries inserted: {len(cidrs):,}")
-    print(f"Time taken: {format_time(elapsed)}")
-    print(f"Insertion rate: {format_rate(len(cidrs), elapsed)}")
-    print(f"Average time per insert: {format_time(elapsed / len(cidrs))}")
-    print(f"Memory used: {mem_used:.2f} MB")
-    print(f"Memory per entry: {mem_used * 1024 / len(cidrs):.2f} KB")
+    p(f"Total entries inserted: {len(cidrs):,}")
+    p(f"Time taken: {format_time(elapsed)}")
+    p(f"Insertion rate: {format_rate(len(cidrs), elapsed)}")
+    p(f"Average time per insert: {format_time(elapsed / len(cidrs))}")
+    p(f"Memory used: {mem_used:.2f} MB")
+    p(f"Memory per entry: {mem_used * 1024 / len(cidrs):.2f} KB")
+    
+    sys.stdout.write("\n".join(out) + "\n")
     
     return {
         'count': len(cidrs),
@@ -114,74 +170,118 @@ def benchmark_insert(fw, cidrs):
     }
 
 
-def benchmark_check(fw, cidrs, num_checks=100000):
-    """Benchmark lookup operations."""
-    print(f"\n📊 Benchmarking Lookups ({num_checks:,} checks)")
-    print("=" * 60)
+def benchmark_check(fw, cidrs, num_checks=100000, detailed=False):
+    """
+    Benchmark lookup operations.
+    
+    With detailed=True, lookups are also timed in chunks of LATENCY_CHUNK to
+    report p50/p95/p99 per-lookup latency; otherwise only throughput is taken.
+    """
+    out = []
+    p = out.append
+    
+    p(f"\n📊 Benchmarking Lookups ({num_checks:,} checks)")
+    p("=" * 60)
     
     # Generate test IPs from the CIDR blocks
     test_ips = []
-    for cidr in cidrs[:min(len(cidrs), num_checks)]:
+    for cidr in islice(cidrs, num_checks):
         try:
-            network = ipaddress.ip_network(cidr, strict=False)
-            # Use the first IP in the range
-            test_ips.append(str(network.network_address))
-        except:
-            pass
+            packed, _ = parse_cidr(cidr)
+        except ValueError:
+            continue
+        # Use the first IP in the range
+        family = socket.AF_INET if len(packed) == 4 else socket.AF_INET6
+        test_ips.append(socket.inet_ntop(family, packed))
     
-    # Add some more to reach target
-    while len(test_ips) < num_checks:
-        # Add some random IPs that might not be in the list
-        test_ips.append(f"8.8.{(len(test_ips) % 256)}.{(len(test_ips) // 256) % 256}")
+    # Add some more to reach target: IPs that might not be in the list
+    test_ips.extend(
+        f"8.8.{n % 256}.{(n // 256) % 256}" for n in range(len(test_ips), num_checks)
+    )
     
-    test_ips = test_ips[:num_checks]
+    check = fw.check
     
     # Warm up cache
-    for ip in test_ips[:1000]:
-        fw.check(ip)
+    for ip in islice(test_ips, 1000):
+        check(ip)
+    
+    results = {}
+    if detailed:
+        # Time whole chunks, derive per-lookup latency by division
+        starts = range(0, len(test_ips), LATENCY_CHUNK)
+        chunk_latencies = array('d', [0.0]) * len(starts)  # Preallocated, no regrowth
+        hits = 0
+        with clean_timing():
+            start_ns = time.perf_counter_ns()
+            for i, base in enumerate(starts):
+                chunk = test_ips[base:base + LATENCY_CHUNK]
+                t0 = time.perf_counter_ns()
+                hits += sum(map(check, chunk))
+                chunk_latencies[i] = (time.perf_counter_ns() - t0) / len(chunk)
+            end_ns = time.perf_counter_ns()
+        
+        ordered = sorted(chunk_latencies)
+        n = len(ordered)
+        for name, q in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+            results[name] = ordered[min(n - 1, int(n * q))] / 1e9
+    else:
+        # Throughput only: one bulk call, no per-chunk bookkeeping
+        check_many = fw.check_many
+        with clean_timing():
+            start_ns = time.perf_counter_ns()
+            hits = sum(check_many(test_ips))
+            end_ns = time.perf_counter_ns()
     
-    # Benchmark
-    start_time = time.time()
-    hits = sum(1 for ip in test_ips if fw.check(ip))
-    end_time = time.time()
+    elapsed = (end_ns - start_ns) / 1e9
     
-    elapsed = end_time - start_time
+    p(f"Total checks: {len(test_ips):,}")
+    p(f"Hits: {hits:,} ({hits * 100 / len(test_ips):.1f}%)")
+    p(f"Misses: {len(test_ips) - hits:,} ({(len(test_ips) - hits) * 100 / len(test_ips):.1f}%)")
+    p(f"Time taken: {format_time(elapsed)}")
+    p(f"Lookup rate: {format_rate(len(test_ips), elapsed)}")
+    p(f"Average time per lookup: {format_time(elapsed / len(test_ips))}")
+    if detailed:
+        p(f"Latency p50/p95/p99: {format_time(results['p50'])} / "
+          f"{format_time(results['p95'])} / {format_time(results['p99'])}")
     
-    print(f"Total checks: {len(test_ips):,}")
-    print(f"Hits: {hits:,} ({hits * 100 / len(test_ips):.1f}%)")
-    print(f"Misses: {len(test_ips) - hits:,} ({(len(test_ips) - hits) * 100 / len(test_ips):.1f}%)")
-    print(f"Time taken: {format_time(elapsed)}")
-    print(f"Lookup rate: {format_rate(len(test_ips), elapsed)}")
-    print(f"Average time per lookup: {format_time(elapsed / len(test_ips))}")
+    sys.stdout.write("\n".join(out) + "\n")
     
-    return {
-        'count': len(test_ips),
-        'hits': hits,
-        'time': elapsed,
-        'rate': len(test_ips) / elapsed,
-    }
+    results.update(
+        count=len(test_ips),
+        hits=hits,
+        time=elapsed,
+        rate=len(test_ips) / elapsed,
+    )
+    return results
 
 
 def benchmark_serialization(fw):
     """Benchmark serialization and deserialization."""
-    print("\n📊 Benchmarking Serialization")
-    print("=" * 60)
+    out = []
+    p = out.append
+    
+    p("\n📊 Benchmarking Serialization")
+    p("=" * 60)
     
     # Serialize
-    start_time = time.time()
-    data = fw.dump()
-    serialize_time = time.time() - start_time
+    with clean_timing():
+        start_ns = time.perf_counter_ns()
+        data = fw.dump()
+        serialize_time = (time.perf_counter_ns() - start_ns) / 1e9
     
     data_size = len(data) / 1024 / 1024  # MB
     
     # Deserialize
-    start_time = time.time()
-    fw2 = CIDARTHA.load(data)
-    deserialize_time = time.time() - start_time
+    with clean_timing():
+        start_ns = time.perf_counter_ns()
+        fw2 = CIDARTHA.load(data)
+        deserialize_time = (time.perf_counter_ns() - start_ns) / 1e9
     
-    print(f"Serialized size: {data_size:.2f} MB")
-    print(f"Serialization time: {format_time(serialize_time)}")
-    print(f"Deserialization time: {format_time(deserialize_time)}")
+    p(f"Serialized size: {data_size:.2f} MB")
+    p(f"Serialization time: {format_time(serialize_time)}")
+    p(f"Deserialization time: {format_time(deserialize_time)}")
+    
+    sys.stdout.write("\n".join(out) + "\n")
     
     return {
         'size_mb': data_size,
@@ -190,8 +290,15 @@ def benchmark_serialization(fw):
     }
 
 
-def run_benchmark():
-    """Main benchmark function."""
+def run_benchmark(output=None, detailed=False):
+    """
+    Main benchmark function.
+    
+    Args:
+        output: Optional path to write the collected results as JSON,
+                so separate runs can be compared without re-running them.
+        detailed: Also report lookup latency percentiles.
+    """
     print("=" * 60)
     print("CIDARTHA Benchmark Suite")
     print("Using Firehol Blocklist-ipsets (Real-World Data)")
@@ -199,10 +306,11 @@ def run_benchmark():
     
     # Download all netset files
     print("\n📥 Downloading Firehol datasets...")
+    # Downloads are network-bound, so fetch all files concurrently
     all_cidrs = []
-    for url in FIREHOL_URLS:
-        cidrs = download_netset(url)
-        all_cidrs.extend(cidrs)
+    with ThreadPoolExecutor(max_workers=len(FIREHOL_URLS)) as executor:
+        for cidrs in executor.map(download_netset, FIREHOL_URLS):
+            all_cidrs.extend(cidrs)
     
     if not all_cidrs:
         print("\n❌ Error: No CIDR blocks downloaded. Check your internet connection.")
@@ -210,8 +318,8 @@ def run_benchmark():
     
     print(f"\n✓ Total CIDR blocks loaded: {len(all_cidrs):,}")
     
-    # Remove duplicates
-    unique_cidrs = list(set(all_cidrs))
+    # Remove duplicates (first occurrence wins, so ordering is reproducible)
+    unique_cidrs = list(dict.fromkeys(all_cidrs))
     if len(unique_cidrs) < len(all_cidrs):
         print(f"✓ Removed {len(all_cidrs) - len(unique_cidrs):,} duplicates")
     all_cidrs = unique_cidrs
@@ -221,34 +329,60 @@ def run_benchmark():
     fw = CIDARTHA()
     
     # Run benchmarks
-    insert_results = benchmark_insert(fw, all_cidrs)
-    check_results = benchmark_check(fw, all_cidrs)
-    serial_results = benchmark_serialization(fw)
+    results = {
+        'dataset': 'Firehol blocklist-ipsets',
+        'total_cidrs': len(all_cidrs),
+        'insert': benchmark_insert(fw, all_cidrs),
+        'lookup': benchmark_check(fw, all_cidrs, detailed=detailed),
+        'serialization': benchmark_serialization(fw),
+    }
     
-    # Summary
-    print("\n" + "=" * 60)
-    print("📈 BENCHMARK SUMMARY")
-    print("=" * 60)
-    print(f"Dataset: Firehol blocklist-ipsets")
-    print(f"Total CIDR blocks: {len(all_cidrs):,}")
-    print(f"\nInsertion:")
-    print(f"  - Rate: {format_rate(insert_results['count'], insert_results['time'])}")
-    print(f"  - Memory: {insert_results['memory_mb']:.2f} MB")
-    print(f"\nLookup:")
-    print(f"  - Rate: {format_rate(check_results['count'], check_results['time'])}")
-    print(f"  - Hit rate: {check_results['hits'] * 100 / check_results['count']:.1f}%")
-    print(f"\nSerialization:")
-    print(f"  - Size: {serial_results['size_mb']:.2f} MB")
-    print(f"  - Serialize: {format_time(serial_results['serialize_time'])}")
-    print(f"  - Deserialize: {format_time(serial_results['deserialize_time'])}")
-    print("=" * 60)
+    sys.stdout.write(render_summary(results))
+    
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✓ Results written to {output}")
     
     return 0
 
 
+def render_summary(results):
+    """Render the summary table from collected benchmark results."""
+    insert_results = results['insert']
+    check_results = results['lookup']
+    serial_results = results['serialization']
+    
+    out = []
+    p = out.append
+    p("\n" + "=" * 60)
+    p("📈 BENCHMARK SUMMARY")
+    p("=" * 60)
+    p(f"Dataset: {results['dataset']}")
+    p(f"Total CIDR blocks: {results['total_cidrs']:,}")
+    p(f"\nInsertion:")
+    p(f"  - Rate: {format_rate(insert_results['count'], insert_results['time'])}")
+    p(f"  - Memory: {insert_results['memory_mb']:.2f} MB")
+    p(f"\nLookup:")
+    p(f"  - Rate: {format_rate(check_results['count'], check_results['time'])}")
+    p(f"  - Hit rate: {check_results['hits'] * 100 / check_results['count']:.1f}%")
+    p(f"\nSerialization:")
+    p(f"  - Size: {serial_results['size_mb']:.2f} MB")
+    p(f"  - Serialize: {format_time(serial_results['serialize_time'])}")
+    p(f"  - Deserialize: {format_time(serial_results['deserialize_time'])}")
+    p("=" * 60)
+    return "\n".join(out) + "\n"
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CIDARTHA Firehol benchmark")
+    parser.add_argument("-o", "--output", help="write results as JSON to this path")
+    parser.add_argument("--detailed", action="store_true",
+                        help="also report lookup latency percentiles")
+    args = parser.parse_args()
+    
     try:
-        sys.exit(run_benchmark())
+        sys.exit(run_benchmark(output=args.output, detailed=args.detailed))
     except KeyboardInterrupt:
         print("\n\n⚠️  Benchmark interrupted by user")
         sys.exit(1)
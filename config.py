@@ -10,17 +10,23 @@ from dataclasses import dataclass
 from typing import Optional
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class CIDARTHAConfig:
     """
     Configuration class for CIDARTHA.
     
+    Instances are immutable; build a new config (or use dataclasses.replace)
+    to change a setting.
+    
     Attributes:
         ip_to_bytes_cache_size: LRU cache size for IP string to bytes conversion (default: 8192)
                                 Note: This cache is global and shared across all instances.
                                 Use configure_global_ip_cache() to adjust it at runtime.
         ip_network_cache_size: LRU cache size for ip_network objects (default: 4096)
-        check_cache_size: LRU cache size for IP lookup results (default: 4096)
+        check_cache_size: LRU cache size for IP lookup results (default: 4096).
+                          None makes the cache unbounded: no LRU bookkeeping, but
+                          every distinct IP checked stays cached until the trie
+                          is modified
         log_level: Logging level for CIDARTHA logger (default: logging.INFO)
         batch_insert_log_interval: Progress logging interval for batch inserts as a fraction 
                                    (default: 0.05 = 5%, i.e., log every 5% of total entries)
@@ -53,7 +59,7 @@ class CIDARTHAConfig:
     """
     ip_to_bytes_cache_size: int = 8192
     ip_network_cache_size: int = 4096
-    check_cache_size: int = 4096
+    check_cache_size: Optional[int] = 4096
     log_level: int = logging.INFO
     batch_insert_log_interval: float = 0.05  # 5% = 1/20
     
@@ -63,14 +69,14 @@ class CIDARTHAConfig:
             raise ValueError("ip_to_bytes_cache_size must be non-negative")
         if self.ip_network_cache_size < 0:
             raise ValueError("ip_network_cache_size must be non-negative")
-        if self.check_cache_size < 0:
+        if self.check_cache_size is not None and self.check_cache_size < 0:
             raise ValueError("check_cache_size must be non-negative")
         if not (0 < self.batch_insert_log_interval <= 1.0):
             raise ValueError("batch_insert_log_interval must be between 0 and 1.0")
 
 
-# Global default configuration instance
-_default_config: Optional[CIDARTHAConfig] = None
+# Global default configuration instance (immutable, so safe to build eagerly)
+_default_config: CIDARTHAConfig = CIDARTHAConfig()
 
 
 def get_default_config() -> CIDARTHAConfig:
@@ -80,9 +86,6 @@ def get_default_config() -> CIDARTHAConfig:
     Returns:
         CIDARTHAConfig: The global default configuration instance.
     """
-    global _default_config
-    if _default_config is None:
-        _default_config = CIDARTHAConfig()
     return _default_config
 
 
@@ -92,6 +95,8 @@ def set_default_config(config: CIDARTHAConfig) -> None:
     
     This allows users to set a default configuration that will be used by all
     new CIDARTHA instances unless they explicitly provide their own config.
+    Replacing the reference is a single assignment, so readers always see
+    either the old or the new config, never a partially built one.
     
     Args:
         config: The configuration to use as the global default.
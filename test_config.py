@@ -4,6 +4,7 @@ Tests for CIDARTHA configuration functionality.
 """
 import unittest
 import logging
+import dataclasses
 from CIDARTHA4 import CIDARTHA, configure_global_ip_cache
 from config import CIDARTHAConfig, get_default_config, set_default_config
 
@@ -48,6 +49,25 @@ class TestCIDARTHAConfiguration(unittest.TestCase):
         cache_info = fw.check.cache_info()
         self.assertEqual(cache_info.maxsize, 2)
     
+    def test_unbounded_check_cache(self):
+        """Test that check_cache_size=None gives an unbounded check cache."""
+        fw = CIDARTHA(config=CIDARTHAConfig(check_cache_size=None))
+        fw.insert("10.0.0.0/8")
+        
+        fw.check_many(f"10.0.{i // 256}.{i % 256}" for i in range(10000))
+        info = fw.check.cache_info()
+        self.assertIsNone(info.maxsize)
+        self.assertEqual(info.currsize, 10000)
+        
+        # Tuning leaves an unbounded cache alone
+        self.assertIsNone(fw.tune_check_cache())
+        self.assertIsNone(fw.check.cache_info().maxsize)
+        self.assertEqual(fw.check.cache_info().currsize, 10000)
+        
+        # Still invalidated on modification
+        fw.insert("192.168.0.0/16")
+        self.assertEqual(fw.check.cache_info().currsize, 0)
+    
     def test_global_default_config(self):
         """Test global default configuration."""
         # Set a global default
@@ -57,6 +77,7 @@ class TestCIDARTHAConfiguration(unittest.TestCase):
         # Create new instance without explicit config
         fw = CIDARTHA()
         self.assertEqual(fw.config.check_cache_size, 8192)
+        self.assertEqual(fw.check.cache_info().maxsize, 8192)
         
         # Reset to default
         set_default_config(CIDARTHAConfig())
@@ -148,6 +169,17 @@ class TestCIDARTHAConfigModule(unittest.TestCase):
         self.assertEqual(config.log_level, logging.WARNING)
         self.assertEqual(config.batch_insert_log_interval, 0.25)
     
+    def test_config_is_immutable(self):
+        """Test that config instances cannot be modified after creation."""
+        config = CIDARTHAConfig()
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            config.check_cache_size = 1
+        
+        # replace() builds a new, validated instance instead
+        updated = dataclasses.replace(config, check_cache_size=1)
+        self.assertEqual(updated.check_cache_size, 1)
+        self.assertEqual(config.check_cache_size, 4096)
+    
     def test_get_default_config(self):
         """Test get_default_config function."""
         config = get_default_config()